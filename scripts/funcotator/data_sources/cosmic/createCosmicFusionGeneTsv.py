@@ -54,9 +54,16 @@ from shared_utils import count_lines
 from argparse import ArgumentParser
 from argparse import RawDescriptionHelpFormatter
 import csv
-from GenericTsvReader import GenericTsvReader
-from collections import OrderedDict
+from collections import Counter, defaultdict
 import re
+
+# Matches each gene in a translocation name, e.g. "BCR{ENST00000305877}:r.1_2866_ABL1{ENST00000318560}:r.461_5766"
+FUSION_GENE_REGEX = re.compile(r"_*([A-Z0-9\-\.]+)\{")
+
+# Buffer size for the output file, so rows are written to disk in large blocks
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+
 def parseOptions():
     
     # Process arguments
@@ -73,12 +80,9 @@ def parseOptions():
     return args
 
 def renderFusionGeneDictEntry(geneKey, fusionGeneDict):
-    fusionGeneSubDict = fusionGeneDict[geneKey]
     resultList = []
-    for k in fusionGeneSubDict.keys():
-        print k
-        print str(fusionGeneSubDict[k])
-        summaryString = "%(k)s(%(fgene)s)" % {'k':k,'fgene':str(fusionGeneSubDict[k])}
+    for k, count in sorted(fusionGeneDict[geneKey]):
+        summaryString = "%(k)s(%(fgene)s)" % {'k':k,'fgene':str(count)}
         resultList.append(summaryString)
     return '|'.join(resultList)
 
@@ -87,52 +91,64 @@ if __name__ == '__main__':
     inputFilename = args.ds_file
     outputFilename = args.output_file
     num_lines = count_lines(inputFilename)
-    tsvReader = GenericTsvReader(inputFilename)
-    headers = tsvReader.getFieldNames()
+    inputFile = file(inputFilename, 'rb')
+    tsvReader = csv.reader(inputFile, delimiter='\t')
+    headers = next(tsvReader)
     print('Found headers (input): ' + str(headers))
     if "Translocation Name" not in headers:
         raise NotImplementedError("Could not find Translocation Name column in the input file.")
+    translocationNameIndex = headers.index("Translocation Name")
     
     outputHeaders = ['gene', 'fusion_genes', 'fusion_id']
     
-    # Create a dictionary where key is the gene and value is another dict: {fusion_gene:count}
-    fusionGeneDict = OrderedDict()
+    # Count each distinct fusion.  The same fusion appears on many lines, so the genes in it only need to be
+    #  extracted once per distinct fusion, rather than once per line.
+    fusionGeneDescriptionCounts = Counter()
     last_i = 0
     for i, line in enumerate(tsvReader):
-        fusion_gene_description = line['Translocation Name']
+        if not line:
+            # blank line
+            continue
+
+        fusion_gene_description = line[translocationNameIndex]
         
         if len(fusion_gene_description.strip()) == 0:
             # blank
             continue
 
-        # geneListKeys = fusionGene.split('/')
-
-        genes_in_this_fusion = re.findall("_*([A-Z0-9\-\.]+)\{", fusion_gene_description)
-
-        for k in genes_in_this_fusion:
-            if k not in fusionGeneDict.keys():
-                fusionGeneDict[k] = dict()
-
-            # Look for the fusion
-            if fusion_gene_description not in fusionGeneDict[k].keys():
-                fusionGeneDict[k][fusion_gene_description] = 0
-
-            fusionGeneDict[k][fusion_gene_description] = fusionGeneDict[k][fusion_gene_description] + 1
+        fusionGeneDescriptionCounts[fusion_gene_description] += 1
 
         if i - last_i > round(float(num_lines)/100.0):
             print("{:.0f}% complete".format(100 * float(i)/float(num_lines)))
             last_i = i
+    inputFile.close()
         
+    # Create a dictionary where key is the gene and value is a list of (fusion_gene, count)
+    fusionGeneDict = defaultdict(list)
+    for fusion_gene_description, count in fusionGeneDescriptionCounts.iteritems():
+
+        # geneListKeys = fusionGene.split('/')
+
+        genes_in_this_fusion = FUSION_GENE_REGEX.findall(fusion_gene_description)
+
+        # A gene listed more than once in a fusion is counted once per listing:
+        for k, numTimesInFusion in Counter(genes_in_this_fusion).iteritems():
+            fusionGeneDict[k].append((fusion_gene_description, count * numTimesInFusion))
+
     # Render the fusionGeneDict
-    tsvWriter = csv.DictWriter(file(outputFilename,'w'), outputHeaders, delimiter='\t', lineterminator="\n")
+    outputFile = file(outputFilename, 'w', OUTPUT_BUFFER_SIZE)
+    tsvWriter = csv.DictWriter(outputFile, outputHeaders, delimiter='\t', lineterminator="\n")
     tsvWriter.fieldnames = outputHeaders
     tsvWriter.writeheader()
-    for k in fusionGeneDict.keys():
+    rows = []
+    for k in sorted(fusionGeneDict.keys()):
         
         row = dict()
         row['gene'] = k
         row['fusion_genes'] = renderFusionGeneDictEntry(k, fusionGeneDict) 
-        tsvWriter.writerow(row)
+        rows.append(row)
+    tsvWriter.writerows(rows)
+    outputFile.close()
     
     pass
     
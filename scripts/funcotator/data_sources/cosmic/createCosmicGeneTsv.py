@@ -91,7 +91,7 @@ if __name__ == '__main__':
     #   and that gene
     last_i = 0
     num_lines = count_lines(inputFilename)
-    geneDictionary = defaultdict(dict)
+    geneDictionary = defaultdict(lambda: defaultdict(int))
     for i, line in enumerate(tsvReader):
         gene = line['Gene name']
 
@@ -100,8 +100,6 @@ if __name__ == '__main__':
             continue
 
         site = line['Primary site']
-        if site not in geneDictionary[gene].keys():
-            geneDictionary[gene][site] = 0
         geneDictionary[gene][site] += 1
 
         # Progress...
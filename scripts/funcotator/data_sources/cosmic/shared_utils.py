@@ -11,15 +11,10 @@ def count_lines(filename):
     """
     if not os.path.exists(filename):
         raise IOError("Please make sure that " + filename + " exists.  Could not be found or read.")
-    lines = 0
-    with open(filename) as f:
+    # Count newlines in large binary blocks, rather than iterating over individual lines.
+    with open(filename, 'rb') as f:
         buf_size = 1024 * 1024
         read_f = f.read # loop optimization
 
-        buf = read_f(buf_size)
-        while buf:
-            lines += buf.count('\n')
-            buf = read_f(buf_size)
-
-    return lines
+        return sum(buf.count(b'\n') for buf in iter(lambda: read_f(buf_size), b''))
 
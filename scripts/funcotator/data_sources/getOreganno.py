@@ -5,58 +5,134 @@
 ########################################################################
 # Imports:
 
+from argparse import ArgumentParser
 import csv
+import os
 import sys
+from collections import OrderedDict
+from itertools import izip
+from multiprocessing.pool import ThreadPool
+from operator import itemgetter
 import urllib2
-from GenericTsvReader import GenericTsvReader
 
 ########################################################################
 # Constants:
 
 FILE_URL = 'http://www.oreganno.org/dump/ORegAnno_Combined_2016.01.19.tsv'
-RAW_FILE_NAME = FILE_URL.split('/')[-1]
 
 OUTPUT_HEADERS = ['Build', 'Chr', 'Start', 'End', 'ID', 'Values']
 
 OUT_HG19_FILE_NAME_TEMPLATE = 'oreganno_%s.HG19.tsv'
 OUT_HG38_FILE_NAME_TEMPLATE = 'oreganno_%s.HG38.tsv'
 
-OREGANNO_KEYS = ['Outcome', 'Type', 'Gene_Symbol', 'Gene_ID', 'Gene_Source', 'Regulatory_Element_Symbol',
-                'Regulatory_Element_ID', 'Regulatory_Element_Source', 'dbSNP_ID', 'PMID', 'Dataset']
+# Output file name template for each build we create a data source for:
+OUT_FILE_NAME_TEMPLATES = OrderedDict([('hg19', OUT_HG19_FILE_NAME_TEMPLATE),
+                                       ('hg38', OUT_HG38_FILE_NAME_TEMPLATE)])
+
+OREGANNO_KEYS = ('Outcome', 'Type', 'Gene_Symbol', 'Gene_ID', 'Gene_Source', 'Regulatory_Element_Symbol',
+                 'Regulatory_Element_ID', 'Regulatory_Element_Source', 'dbSNP_ID', 'PMID', 'Dataset')
 
 VALUES_DELIMITER = '|'
 NON_VALUE = "N/A"
 
 ENABLE_STDOUT = True
 
+# Buffer size for the output files, so rows are written to disk in large blocks:
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+# Size of each read when downloading, and the number of byte ranges to download in parallel:
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+NUM_DOWNLOAD_CONNECTIONS = 4
+
 ########################################################################
 # Functions:
 
 FLUSH = sys.stdout.flush
 
 
-def get_values_data_from_row_dict(r):
-    values = []
+def parse_options():
+    parser = ArgumentParser(description='Downloads and formats data for the Oreganno data source directly from the '
+                                        'Oreganno website.')
+    parser.add_argument('-u', '--url', default=FILE_URL,
+                        help='URL of the ORegAnno combined TSV file to download.  (default: %(default)s)')
+    parser.add_argument('-i', '--input-file',
+                        help='Previously downloaded ORegAnno combined TSV file.  If given, nothing is downloaded.  '
+                             'Otherwise the file is always downloaded again, even if a copy already exists, so pass '
+                             'this to reuse an existing download.')
+    parser.add_argument('-o', '--output-dir', default='.',
+                        help='Directory in which to write the downloaded file and the output files.  '
+                             '(default: %(default)s)')
+    return parser.parse_args()
+
+
+def get_values_data(values):
+    """Create the Values field from the given record values, which are in the same order as OREGANNO_KEYS."""
+    stripped_values = ((key, val.strip()) for key, val in izip(OREGANNO_KEYS, values))
+    return VALUES_DELIMITER.join(key + "=" + val for key, val in stripped_values if val != NON_VALUE)
+
+
+def get_file_range_from_url(url, file_name, start, end):
+    """Download bytes start through end (inclusive) of the given url into the same bytes of the existing file_name."""
+    u = urllib2.urlopen(urllib2.Request(url, headers={'Range': 'bytes=%d-%d' % (start, end)}))
+    if u.getcode() != 206:
+        raise IOError("Server did not honor byte range request for " + url)
+
+    content_range = u.info().getheader('Content-Range', '')
+    if not content_range.startswith('bytes %d-%d/' % (start, end)):
+        raise IOError("Server returned byte range '%s' for requested bytes %d-%d of %s" %
+                      (content_range, start, end, url))
+
+    # A dropped connection gives a short read rather than an error, so count what we get.
+    #  Otherwise the missing bytes would silently stay zero in the preallocated file.
+    bytes_remaining = end - start + 1
+    with open(file_name, 'r+b') as f:
+        f.seek(start)
+        while bytes_remaining > 0:
+            buffer = u.read(min(DOWNLOAD_BLOCK_SIZE, bytes_remaining))
+            if not buffer:
+                break
+            f.write(buffer)
+            bytes_remaining -= len(buffer)
+    u.close()
+
+    if bytes_remaining != 0:
+        raise IOError("Download of bytes %d-%d of %s ended %d bytes early" % (start, end, url, bytes_remaining))
+
+
+def get_file_from_url(url, file_name, num_connections=NUM_DOWNLOAD_CONNECTIONS):
+    """Taken from: https://stackoverflow.com/a/22776
+
+    If the server supports byte range requests, the file is split into num_connections ranges which are
+    downloaded in parallel.  Otherwise it is downloaded in a single stream."""
+
+    # Ask for the whole file as a byte range, so the response tells us whether ranges are supported:
+    u = urllib2.urlopen(urllib2.Request(url, headers={'Range': 'bytes=0-'}))
+    meta = u.info()
+    file_size = int(meta.getheaders("Content-Length")[0])
+    print "Downloading: %s Bytes: %s" % (file_name, file_size)
 
-    for i in xrange(0, len(OREGANNO_KEYS)):
-        key = OREGANNO_KEYS[i]
-        val = r[key].strip()
-        if val != NON_VALUE:
-            values.append(key + "=" + val)
+    if u.getcode() == 206 and num_connections > 1 and file_size > DOWNLOAD_BLOCK_SIZE:
+        u.close()
 
-    return VALUES_DELIMITER.join(values)
+        # Create the whole file up front, so each range can be written into place:
+        with open(file_name, 'wb') as f:
+            f.truncate(file_size)
 
+        range_size = (file_size + num_connections - 1) / num_connections
+        ranges = [(start, min(start + range_size, file_size) - 1) for start in xrange(0, file_size, range_size)]
 
-def get_file_from_url(url, file_name):
-    """Taken from: https://stackoverflow.com/a/22776"""
-    u = urllib2.urlopen(url)
-    f = open(file_name, 'wb')
-    meta = u.info()
-    file_size = int(meta.getheaders("Content-Length")[0])
-    print "Downloading: %s Bytes: %s" % (file_name, file_size)
+        pool = ThreadPool(len(ranges))
+        try:
+            pool.map(lambda r: get_file_range_from_url(url, file_name, r[0], r[1]), ranges)
+        finally:
+            pool.close()
+            pool.join()
+        return
 
+    f = open(file_name, 'wb')
     file_size_dl = 0
-    block_sz = 8192
+    last_status_dl = 0
+    block_sz = DOWNLOAD_BLOCK_SIZE
     while True:
         buffer = u.read(block_sz)
         if not buffer:
@@ -64,24 +140,21 @@ def get_file_from_url(url, file_name):
 
         file_size_dl += len(buffer)
         f.write(buffer)
-        status = r"%10d  [%3.2f%%]" % (file_size_dl, file_size_dl * 100. / file_size)
-        status = status + chr(8) * (len(status) + 1)
-        print status,
 
-    f.close()
+        # Only update the status every 1% of the file:
+        if file_size_dl - last_status_dl >= file_size / 100:
+            status = r"%10d  [%3.2f%%]" % (file_size_dl, file_size_dl * 100. / file_size)
+            status = status + chr(8) * (len(status) + 1)
+            print status,
+            last_status_dl = file_size_dl
 
+    f.close()
+    u.close()
 
-def row_comparator(x,y):
 
-    chrCmp = cmp(x['Chr'], y['Chr'])
-    if chrCmp == 0:
-        startCmp = cmp(int(x['Start']), int(y['Start']))
-        if startCmp == 0:
-            return cmp(int(x['End']), int(y['End']))
-        else:
-            return startCmp
-    else:
-        return chrCmp
+def row_sort_key(row):
+    """Sort key for an output row (ordered as OUTPUT_HEADERS): chromosome, then start, then end."""
+    return row[1], int(row[2]), int(row[3])
 
 
 ########################################################################
@@ -89,95 +162,89 @@ def row_comparator(x,y):
 
 if __name__ == '__main__':
 
+    args = parse_options()
+
     if not ENABLE_STDOUT: print 'Processing OReganno files ...'
 
-    if ENABLE_STDOUT: print 'Downloading Oreganno file:', RAW_FILE_NAME, '...',
-    if ENABLE_STDOUT: FLUSH()
-    # Download the Raw file:
-    # get_file_from_url(FILE_URL, RAW_FILE_NAME)
-    if ENABLE_STDOUT: print 'DONE!'
-    if ENABLE_STDOUT: FLUSH()
+    if args.input_file:
+        raw_file_name = args.input_file
+    else:
+        raw_file_name = os.path.join(args.output_dir, args.url.split('/')[-1])
+
+        if ENABLE_STDOUT: print 'Downloading Oreganno file:', raw_file_name, '...',
+        if ENABLE_STDOUT: FLUSH()
+        # Download the Raw file:
+        get_file_from_url(args.url, raw_file_name)
+        if ENABLE_STDOUT: print 'DONE!'
+        if ENABLE_STDOUT: FLUSH()
 
     # Get the version of the file:
-    file_version = RAW_FILE_NAME.replace('ORegAnno_Combined_', '').replace('.tsv', '').replace('.', '')
+    file_version = os.path.basename(raw_file_name).replace('ORegAnno_Combined_', '').replace('.tsv', '').replace('.', '')
 
     # Now that we have the file, go through it and reformat it:
-    tsvReader = GenericTsvReader(RAW_FILE_NAME)
-    headers = tsvReader.getFieldNames()
+    raw_file = open(raw_file_name, 'rb')
+    tsvReader = csv.reader(raw_file, delimiter='\t')
+    headers = next(tsvReader)
     if ENABLE_STDOUT: print('Found headers (input): ' + str(headers))
     if ENABLE_STDOUT: FLUSH()
 
-    hg19_dataset = []
-    hg38_dataset = []
+    # Look up the columns we need once, rather than by name on every record:
+    species_i, build_i, chr_i, start_i, end_i, id_i = \
+        [headers.index(h) for h in ('Species', 'Build', 'Chr', 'Start', 'End', 'ORegAnno_ID')]
+    get_oreganno_values = itemgetter(*[headers.index(k) for k in OREGANNO_KEYS])
+
+    # Records for each output build, partitioned as we read them in:
+    datasets = OrderedDict((build, []) for build in OUT_FILE_NAME_TEMPLATES)
+    num_non_human = 0
+    num_incompatible_build = 0
 
     if ENABLE_STDOUT: print 'Iterating through input file ...',
     if ENABLE_STDOUT: FLUSH()
     # Go through our file:
-    for lineNum, line in enumerate(tsvReader):
+    for line in tsvReader:
+
+        # Skip blank lines:
+        if not line:
+            continue
 
-        if line['Species'].lower() != 'homo sapiens':
-            if ENABLE_STDOUT: print '    Ignoring non-human record on line:', lineNum, " : ", line['Species'].lower()
-            if ENABLE_STDOUT: FLUSH()
+        if line[species_i].lower() != 'homo sapiens':
+            num_non_human += 1
             continue
 
-        # Get the trivial fields here:
-        row = dict()
-        row['Build'] = line['Build'].strip()
-        row['Chr'] = line['Chr'].strip()
-        row['Start'] = line['Start'].strip()
-        row['End'] = line['End'].strip()
-        row['ID'] = line['ORegAnno_ID'].strip()
-
-        # Get the values field from our helper method:
-        row['Values'] = get_values_data_from_row_dict(line)
-
-        if line['Build'].lower() == 'hg19':
-            hg19_dataset.append(row)
-        elif line['Build'].lower() == 'hg38':
-            hg38_dataset.append(row)
-        else:
-            if ENABLE_STDOUT: print '    Ignoring incompatible build record on line:', lineNum, " : ", line['Build'].lower()
-            if ENABLE_STDOUT: FLUSH()
+        dataset = datasets.get(line[build_i].lower())
+        if dataset is None:
+            num_incompatible_build += 1
+            continue
 
-    if ENABLE_STDOUT: print 'DONE!'
-    if ENABLE_STDOUT: FLUSH()
+        # Get the trivial fields here, followed by the values field from our helper method
+        # (in the same order as OUTPUT_HEADERS):
+        dataset.append((line[build_i].strip(),
+                        line[chr_i].strip(),
+                        line[start_i].strip(),
+                        line[end_i].strip(),
+                        line[id_i].strip(),
+                        get_values_data(get_oreganno_values(line))))
+
+    raw_file.close()
 
-    if ENABLE_STDOUT: print 'Creating output files ...',
-    if ENABLE_STDOUT: FLUSH()
-    # Set up the output files:
-    out_hg19_tsv_writer = csv.DictWriter(file(OUT_HG19_FILE_NAME_TEMPLATE % file_version, 'w'), OUTPUT_HEADERS,
-                                         delimiter='\t', lineterminator="\n")
-    out_hg19_tsv_writer.fieldnames = OUTPUT_HEADERS
-    out_hg19_tsv_writer.writeheader()
-    out_hg38_tsv_writer = csv.DictWriter(file(OUT_HG38_FILE_NAME_TEMPLATE % file_version, 'w'), OUTPUT_HEADERS,
-                                         delimiter='\t', lineterminator="\n")
-    out_hg38_tsv_writer.fieldnames = OUTPUT_HEADERS
-    out_hg38_tsv_writer.writeheader()
     if ENABLE_STDOUT: print 'DONE!'
+    if ENABLE_STDOUT: print '    Ignored', num_non_human, 'non-human records.'
+    if ENABLE_STDOUT: print '    Ignored', num_incompatible_build, 'incompatible build records.'
     if ENABLE_STDOUT: FLUSH()
-    
-    print 'Sorting hg19 dataset ...',
-    FLUSH()
-    hg19_dataset.sort(row_comparator)
-    print 'DONE!'
-    FLUSH()
-
-    print 'Writing hg19 dataset ...',
-    FLUSH()
-    for row in hg19_dataset:
-        out_hg19_tsv_writer.writerow(row)
-    print 'DONE!'
-    FLUSH()
-
-    print 'Sorting hg38 dataset ...',
-    FLUSH()
-    hg38_dataset.sort(row_comparator)
-    print 'DONE!'
-    FLUSH()
-
-    print 'Writing hg38 dataset ...',
-    FLUSH()
-    for row in hg38_dataset:
-        out_hg38_tsv_writer.writerow(row)
-    print 'DONE!'
-    FLUSH()
+
+    for build, dataset in datasets.iteritems():
+        print 'Sorting', build, 'dataset ...',
+        FLUSH()
+        dataset.sort(key=row_sort_key)
+        print 'DONE!'
+        FLUSH()
+
+        print 'Writing', build, 'dataset ...',
+        FLUSH()
+        out_file_name = os.path.join(args.output_dir, OUT_FILE_NAME_TEMPLATES[build] % file_version)
+        with open(out_file_name, 'w', OUTPUT_BUFFER_SIZE) as out_file:
+            out_tsv_writer = csv.writer(out_file, delimiter='\t', lineterminator="\n")
+            out_tsv_writer.writerow(OUTPUT_HEADERS)
+            out_tsv_writer.writerows(dataset)
+        print 'DONE!'
+        FLUSH()